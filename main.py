@@ -1,68 +1,330 @@
 import streamlit as st
 import random
-import pandas as pd
 import json
+import csv
 import os
 import hashlib
-from io import StringIO
+import hmac
+import secrets
+import bisect
+import functools
+import re
+import time
+import atexit
+import threading
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import TextIOWrapper
+
+try:
+    import orjson  # optional, much faster than the stdlib json module
+except ImportError:
+    orjson = None
 
 # --- Configuration ---
 USERS_FILE = "users.json"
 DATA_PREFIX = "data_"  # distinct files: data_username.json
+FLUSH_INTERVAL = 2.0  # seconds between debounced flushes of the edit log
+PRETTY_JSON = False  # indent files on disk for hand editing (slower, larger writes)
+COMPACT_RATIO = 2  # fold the edit log into the snapshot once it outgrows it by this factor
+SCRYPT_PARAMS = {"n": 2 ** 14, "r": 8, "p": 1}  # KDF cost for new password hashes
+_UNSAFE_USERNAME = re.compile(r'[^\w-]+')  # \w matches what str.isalnum() plus '_' allow
+# Tag badge colours, cycled per tag; kept at 8 so the index can wrap with `i & 7`
+_TAG_BG = ("#e0f2f1", "#e3f2fd", "#f3e5f5", "#fbe9e7", "#fff3e0", "#e8f5e9", "#fce4ec", "#e8eaf6")
+_TAG_FG = ("#00695c", "#1565c0", "#6a1b9a", "#d84315", "#ef6c00", "#2e7d32", "#ad1457", "#283593")
 
 st.set_page_config(page_title="Keyword & Tag Manager", layout="centered")
 
-# --- Security & Auth Functions ---
-def make_hashes(password):
-    """Returns SHA-256 hash of the password."""
-    return hashlib.sha256(str.encode(password)).hexdigest()
+# --- JSON Helpers ---
+def _json_loads(data):
+    """Parses JSON from bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_dumps(obj, pretty=False):
+    """Serializes obj to JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+    # Match orjson's output: raw UTF-8 rather than \u escapes, two-space indent
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
 
-def check_hashes(password, hashed_text):
-    """Checks if password matches the hash."""
-    if make_hashes(password) == hashed_text:
+# --- Security & Auth Functions ---
+def make_hashes(password, salt, n, r, p):
+    """Returns the hex scrypt hash of the password."""
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, dklen=32).hex()
+
+def make_user_record(password):
+    """Returns the credentials entry stored in users.json for a new password."""
+    salt = secrets.token_bytes(16)
+    return {
+        "salt": salt.hex(),
+        "hash": make_hashes(password, salt, **SCRYPT_PARAMS),
+        "kdf": "scrypt",
+        **SCRYPT_PARAMS,
+    }
+
+def check_hashes(password, record):
+    """Checks if password matches the stored credentials entry."""
+    if isinstance(record, str):
+        # Accounts created before salted hashes store a bare SHA-256 hex digest
+        hashed = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return hmac.compare_digest(hashed, record)
+    hashed = make_hashes(password, bytes.fromhex(record['salt']), record['n'], record['r'], record['p'])
+    return hmac.compare_digest(hashed, record['hash'])
+
+def needs_rehash(record):
+    """Checks if a credentials entry predates the current KDF or its cost settings."""
+    if isinstance(record, str):
         return True
-    return False
+    return record.get('kdf') != "scrypt" or any(record.get(k) != v for k, v in SCRYPT_PARAMS.items())
+
+@st.cache_resource
+def _users_cache():
+    """Process-wide parsed users file, with the mtime it was read at."""
+    return {"mtime": None, "users": {}, "lock": threading.Lock()}
 
 def load_users():
-    """Loads the user credentials database."""
-    if os.path.exists(USERS_FILE):
-        try:
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-    return {}
+    """Loads the user credentials database.
+
+    The parsed dict is shared and only re-read when the file's mtime changes;
+    treat it as read-only outside `save_user`.
+    """
+    cache = _users_cache()
+    try:
+        mtime = os.stat(USERS_FILE).st_mtime_ns
+        if cache["mtime"] != mtime:
+            with open(USERS_FILE, 'rb') as f:
+                cache["users"] = _json_loads(f.read())
+            cache["mtime"] = mtime
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return cache["users"]
+
+def _file_size(path):
+    """Returns the size of path in bytes, or 0 if it doesn't exist."""
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def _write_json_atomic(path, obj):
+    """Writes obj as JSON via a temp file, so a crash mid-write can't truncate `path`.
+
+    Returns the written file's stat result (the rename keeps its size and mtime).
+    """
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(_json_dumps(obj, pretty=PRETTY_JSON))
+        # Make the new contents durable before the rename publishes them
+        f.flush()
+        os.fsync(f.fileno())
+        stat = os.fstat(f.fileno())
+    os.replace(tmp, path)
+    return stat
 
 def save_user(username, password):
     """Saves a new user to the credentials database."""
-    users = load_users()
-    users[username] = make_hashes(password)
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
-
+    record = make_user_record(password)
+    cache = _users_cache()
+    with cache["lock"]:
+        users = dict(load_users())
+        users[username] = record
+        stat = _write_json_atomic(USERS_FILE, users)
+        # Adopt what we just wrote instead of re-reading it on the next load
+        cache["users"], cache["mtime"] = users, stat.st_mtime_ns
+
+@functools.lru_cache(maxsize=128)
 def get_user_data_file(username):
     """Returns the filename for a specific user's data."""
     # Simple sanitization to prevent directory traversal
-    safe_username = "".join([c for c in username if c.isalnum() or c in ('_', '-')])
-    return f"{DATA_PREFIX}{safe_username}.json"
+    return f"{DATA_PREFIX}{_UNSAFE_USERNAME.sub('', username)}.json"
+
+def get_user_log_file(username):
+    """Returns the filename of the edit log kept next to a user's data file."""
+    # Derived from the data file so both always share one sanitized name
+    return os.path.splitext(get_user_data_file(username))[0] + ".jsonl"
 
 # --- Data Persistence Functions ---
+# A user's data lives in a JSON snapshot (data_<user>.json) plus an append-only
+# log of edits made since (data_<user>.jsonl), one JSON op per line. Edits only
+# append to the log; the snapshot is rewritten when the log is compacted.
+#
+# On disk the snapshot is {"entries": [{"Keyword": ..., "Tags": [...]}, ...],
+# "tags": [...]}, with "tags" holding the tags in use in sorted order so login can
+# seed all_tags without a pass over the entries; in memory the db is a dict of
+# keyword -> set of tags.
+def entries_to_db(entries):
+    """Converts snapshot records to the in-memory db, merging repeated keywords."""
+    db = {}
+    for entry in entries:
+        db.setdefault(entry['Keyword'], set()).update(entry.get('Tags', []))
+    return db
+
+def db_to_entries(db):
+    """Converts the in-memory db to snapshot records, with tags sorted."""
+    return [{"Keyword": kw, "Tags": sorted(tags)} for kw, tags in db.items()]
+
+def apply_op(db, op):
+    """Applies one logged edit to db in place."""
+    if op['op'] == 'set':
+        db[op['keyword']] = set(op['tags'])
+    elif op['op'] == 'remove':
+        db.pop(op['keyword'], None)
+
+def replay_log(entries, path):
+    """Builds the db from snapshot records plus every edit recorded in the log at path."""
+    db = entries_to_db(entries)
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    op = _json_loads(line)
+                except ValueError:
+                    # Torn last line from an interrupted write; it may end mid-character,
+                    # which raises UnicodeDecodeError rather than JSONDecodeError
+                    continue
+                apply_op(db, op)
+    except FileNotFoundError:
+        pass
+    return db
+
 def load_data(username):
-    """Loads data specific to the logged-in user."""
+    """Loads data specific to the logged-in user.
+
+    Returns (db, sorted_tags); sorted_tags is None for a snapshot saved before the
+    tags were stored, which the caller should re-save in the current format.
+    """
     filename = get_user_data_file(username)
-    if os.path.exists(filename):
-        try:
-            with open(filename, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return []
-    return []
+    try:
+        # Read once per login and rewritten by every compaction, so not worth caching
+        with open(filename, 'rb') as f:
+            snapshot = _json_loads(f.read())
+    except (FileNotFoundError, json.JSONDecodeError):
+        snapshot = {"entries": [], "tags": []}
+    if isinstance(snapshot, list):
+        # Legacy format: a bare list of entries
+        snapshot = {"entries": snapshot, "tags": None}
+    return replay_log(snapshot["entries"], get_user_log_file(username)), snapshot["tags"]
 
 def save_data(username):
-    """Saves current session db to the user's specific file."""
+    """Saves current session db to the user's specific file and returns its size in bytes."""
     filename = get_user_data_file(username)
-    with open(filename, 'w') as f:
-        json.dump(st.session_state.db, f, indent=4)
+    snapshot = {"entries": db_to_entries(st.session_state.db), "tags": st.session_state.sorted_tags}
+    return _write_json_atomic(filename, snapshot).st_size
+
+class AppendWriter:
+    """Buffers appends to a log file in memory and writes them out in one syscall per flush.
+
+    The file is opened lazily on the first flush and kept open until `close`.
+    One writer is shared by every session of a user, so all methods hold a lock.
+    The lock only keeps appends whole; concurrent sessions of one user aren't
+    merged, and the last one to compact wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._buf = bytearray()
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            self._buf += data
+
+    def flush(self):
+        """Writes out buffered appends; returns whether there were any."""
+        with self._lock:
+            return self._flush()
+
+    def _flush(self):
+        if not self._buf:
+            return False
+        if self._file is None:
+            self._file = open(self.path, 'ab', buffering=0)
+        written = self._file.write(self._buf)
+        while written < len(self._buf):  # raw writes may be partial
+            written += self._file.write(self._buf[written:])
+        self._buf.clear()
+        return True
+
+    def size(self):
+        """Returns the number of bytes already flushed to the file."""
+        with self._lock:
+            if self._file is None:
+                return _file_size(self.path)
+            return os.fstat(self._file.fileno()).st_size
+
+    def reset(self):
+        """Discards buffered and flushed contents, leaving an empty log."""
+        with self._lock:
+            self._buf.clear()
+            if self._file is not None:
+                self._file.truncate(0)
+            else:
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        """Flushes and releases the file handle; a later flush reopens it."""
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+@st.cache_resource
+def get_append_writer(username):
+    """Returns the long-lived writer for a user's edit log, shared across reruns."""
+    writer = AppendWriter(get_user_log_file(username))
+    atexit.register(writer.close)
+    return writer
+
+def append_op(op):
+    """Records an edit in the session's log; the write is buffered until `flush_if_needed`."""
+    get_append_writer(st.session_state.username).write(_json_dumps(op) + b"\n")
+
+def compact_data(username):
+    """Writes the session db as a new snapshot and discards the log it supersedes."""
+    # Drop tags no entry carries any more, so a tag removed everywhere stops being offered
+    tag_index = st.session_state.tag_index
+    if len(tag_index) != len(st.session_state.sorted_tags):
+        st.session_state.sorted_tags = [t for t in st.session_state.sorted_tags if t in tag_index]
+        st.session_state.all_tags = set(st.session_state.sorted_tags)
+    st.session_state.snapshot_size = save_data(username)
+    get_append_writer(username).reset()
+
+def index_tags(db):
+    """Interns every tag label in db and maps each tag to the keywords carrying it.
+
+    Tags repeat across many entries; `sys.intern` keeps one string object per label.
+    """
+    index = {}
+    for kw, tags in db.items():
+        tags = db[kw] = {sys.intern(tag) for tag in tags}
+        for tag in tags:
+            index.setdefault(tag, set()).add(kw)
+    return index
+
+def load_user_state(username):
+    """Loads a user's db and derives its tag structures.
+
+    Touches no session state, so it can run on a worker thread during login.
+    Returns (db, all_tags, sorted_tags, tag_index, needs_resave).
+    """
+    db, stored_tags = load_data(username)
+    tag_index = index_tags(db)
+    sorted_tags = [sys.intern(tag) for tag in stored_tags or ()]
+    all_tags = set(sorted_tags)
+    if stored_tags is None or not all_tags.issuperset(tag_index):
+        # Legacy snapshot, or the log added tags since it was written
+        all_tags.update(tag_index)
+        sorted_tags = sorted(all_tags)
+    return db, all_tags, sorted_tags, tag_index, stored_tags is None
 
 # --- Session State Initialization ---
 if 'logged_in' not in st.session_state:
@@ -70,25 +332,146 @@ if 'logged_in' not in st.session_state:
 if 'username' not in st.session_state:
     st.session_state.username = ""
 if 'db' not in st.session_state:
-    st.session_state.db = []
+    st.session_state.db = {}  # keyword -> set of tags
 if 'all_tags' not in st.session_state:
     st.session_state.all_tags = set()
+if 'sorted_tags' not in st.session_state:
+    st.session_state.sorted_tags = []  # all_tags in sorted order, for widget options
+if 'tag_index' not in st.session_state:
+    st.session_state.tag_index = {}  # tag -> keywords carrying it
 if 'random_result' not in st.session_state:
-    st.session_state.random_result = None
+    st.session_state.random_result = None  # keyword of the last random pick
+if 'random_result_html' not in st.session_state:
+    st.session_state.random_result_html = ""
+    st.session_state.random_result_html_rev = -1  # db_rev the html was rendered at
+if 'db_token' not in st.session_state:
+    st.session_state.db_token = secrets.token_hex(8)
+if 'db_rev' not in st.session_state:
+    st.session_state.db_rev = 0
+if 'db_dirty' not in st.session_state:
+    st.session_state.db_dirty = False
+if 'db_last_flush' not in st.session_state:
+    st.session_state.db_last_flush = time.monotonic()
+if 'snapshot_size' not in st.session_state:
+    st.session_state.snapshot_size = 0
+
+def db_key():
+    """Identifies the current revision of this session's db, for use as a cache key."""
+    return (st.session_state.db_token, st.session_state.db_rev)
+
+def bump_db_rev():
+    """Marks the session db as changed, invalidating caches keyed on `db_key`."""
+    st.session_state.db_rev += 1
+
+def mark_dirty():
+    """Flags the session db as edited; the logged ops reach disk on the next `flush_if_needed`."""
+    bump_db_rev()
+    st.session_state.db_dirty = True
+
+def flush_if_needed(force=False):
+    """Writes out the session's pending edits, if any.
+
+    Flushes are debounced to one per FLUSH_INTERVAL so bursts of edits share a
+    single write; `force` skips the debounce and also compacts any non-empty log,
+    even if autosave already flushed every edit (e.g. on logout). The log is
+    compacted anyway once it outgrows the snapshot.
+    """
+    if not force:
+        if not st.session_state.db_dirty:
+            return
+        if time.monotonic() - st.session_state.db_last_flush < FLUSH_INTERVAL:
+            return
+    log = get_append_writer(st.session_state.username)
+    log.flush()
+    size = log.size()
+    if size and (force or size > COMPACT_RATIO * st.session_state.snapshot_size):
+        compact_data(st.session_state.username)
+    st.session_state.db_dirty = False
+    st.session_state.db_last_flush = time.monotonic()
+
+@st.fragment(run_every=FLUSH_INTERVAL)
+def autosave():
+    """Reruns on a timer so edits debounced by `flush_if_needed` still reach disk when the user goes idle.
+
+    Only rendered while edits are pending; once they are flushed, a full rerun
+    drops the fragment and so stops the timer.
+    """
+    flush_if_needed()
+    if not st.session_state.db_dirty:
+        st.rerun()
 
 # --- Logic Functions ---
+def parse_tags(text):
+    """Splits comma-separated tag input into a set of stripped, interned labels."""
+    return {sys.intern(t) for t in map(str.strip, text.split(',')) if t}
+
+def register_tags(tags):
+    """Adds a set of tags to all_tags, keeping sorted_tags in order."""
+    unseen = tags - st.session_state.all_tags
+    if unseen:
+        st.session_state.all_tags |= unseen
+        if len(unseen) == 1:
+            bisect.insort(st.session_state.sorted_tags, next(iter(unseen)))
+        else:
+            # sorted_tags is one sorted run, so timsort merges a batch in about linear time
+            st.session_state.sorted_tags = sorted(st.session_state.sorted_tags + list(unseen))
+
+def reindex_entry(keyword, old_tags, new_tags):
+    """Updates tag_index after the tags of `keyword` change from old_tags to new_tags."""
+    tag_index = st.session_state.tag_index
+    for tag in old_tags - new_tags:
+        keywords = tag_index.get(tag)
+        if keywords is not None:
+            keywords.discard(keyword)
+            if not keywords:
+                del tag_index[tag]
+    for tag in new_tags - old_tags:
+        tag_index.setdefault(tag, set()).add(keyword)
+
+@st.cache_resource
+def _prefetch_pool():
+    """Process-wide workers for login prefetches, bounded so failed logins can't pile up loads."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="login-prefetch")
+
 def login_user(username, password):
     users = load_users()
-    if username in users and check_hashes(password, users[username]):
+    authenticated = False
+    if username in users:
+        # Read and index the user's data while the KDF check runs (scrypt releases the GIL)
+        prefetch = _prefetch_pool().submit(load_user_state, username)
+        authenticated = check_hashes(password, users[username])
+        if not authenticated:
+            # Drop the load if it is still queued; a running one just finishes unread
+            prefetch.cancel()
+    if authenticated:
+        if needs_rehash(users[username]):
+            # The plaintext is only available now, so upgrade legacy/weaker hashes on login
+            save_user(username, password)
+        try:
+            # Write out edits an earlier session left buffered; if there were any, the prefetch missed them
+            if get_append_writer(username).flush():
+                state = load_user_state(username)
+            else:
+                state = prefetch.result()
+        except Exception as e:
+            st.error(f"Error loading your data: {e}")
+            return
+        db, all_tags, sorted_tags, tag_index, needs_resave = state
         st.session_state.logged_in = True
         st.session_state.username = username
-        st.session_state.db = load_data(username)
-        # Rebuild tags for this user
-        tags = set()
-        for entry in st.session_state.db:
-            for tag in entry.get('Tags', []):
-                tags.add(tag)
-        st.session_state.all_tags = tags
+        st.session_state.db = db
+        bump_db_rev()
+        # Seed the tags once; from here on the mutators keep them up to date
+        st.session_state.all_tags = all_tags
+        st.session_state.sorted_tags = sorted_tags
+        st.session_state.tag_index = tag_index
+        if needs_resave or get_append_writer(username).size():
+            # Migrate a legacy snapshot, or fold in edits left over from a session that never logged out
+            compact_data(username)
+        else:
+            st.session_state.snapshot_size = _file_size(get_user_data_file(username))
+        # Per-session generator, so picks don't contend on the module-level random instance
+        st.session_state.rng = random.Random(os.urandom(8))
         st.rerun()
     else:
         st.error("Incorrect Username or Password")
@@ -102,10 +485,16 @@ def register_user(username, password):
         st.success("Account created! Please log in.")
 
 def logout():
+    flush_if_needed(force=True)
+    # Don't hold a file descriptor per user who ever logged in
+    get_append_writer(st.session_state.username).close()
     st.session_state.logged_in = False
     st.session_state.username = ""
-    st.session_state.db = []
+    st.session_state.db = {}
+    bump_db_rev()
     st.session_state.all_tags = set()
+    st.session_state.sorted_tags = []
+    st.session_state.tag_index = {}
     st.session_state.random_result = None
     st.rerun()
 
@@ -114,124 +503,151 @@ def add_entry(keyword, selected_tags, new_tags_input):
         st.error("Please enter a keyword.")
         return
 
-    final_tags = list(selected_tags)
+    final_tags = set(selected_tags)
     
     # Process multiple comma-separated new tags
     if new_tags_input:
-        new_tags = [t.strip() for t in new_tags_input.split(',') if t.strip()]
-        for tag in new_tags:
-            if tag not in final_tags:
-                final_tags.append(tag)
-                st.session_state.all_tags.add(tag)
-
-    entry = {"Keyword": keyword, "Tags": final_tags}
-    
-    # Check if keyword already exists, if so, just update tags (Optional logic, currently append)
-    # For this specific function, we will append, but in production checking for dupes is better.
-    st.session_state.db.append(entry)
-    save_data(st.session_state.username)
-    st.success(f"Added '{keyword}'")
-
-def update_entry(index, tags_to_add, new_tags_text, tags_to_remove):
-    if 0 <= index < len(st.session_state.db):
-        current_tags = st.session_state.db[index]['Tags']
-        
-        # Add new custom tags
+        new_tags = parse_tags(new_tags_input)
+        final_tags |= new_tags
+        register_tags(new_tags)
+
+    # Adding an existing keyword merges the tags into it
+    is_new = keyword not in st.session_state.db
+    tags = st.session_state.db.setdefault(keyword, set())
+    added = final_tags - tags
+    if not is_new and not added:
+        st.info(f"'{keyword}' already has these tags.")
+        return
+    tags |= added
+    reindex_entry(keyword, set(), added)
+    append_op({"op": "set", "keyword": keyword, "tags": sorted(tags)})
+    mark_dirty()
+    st.success(f"Added '{keyword}'" if is_new else f"Added tags to '{keyword}'")
+
+def update_entry(keyword, tags_to_add, new_tags_text, tags_to_remove):
+    if not tags_to_add and not new_tags_text.strip() and not tags_to_remove:
+        st.toast("Nothing to update.")
+        return
+    current_tags = st.session_state.db.get(keyword)
+    if current_tags is not None:
+        # Add existing and new custom tags
+        added = set(tags_to_add)
         if new_tags_text:
-            new_tags = [t.strip() for t in new_tags_text.split(',') if t.strip()]
-            for tag in new_tags:
-                if tag and tag not in current_tags:
-                    current_tags.append(tag)
-                    st.session_state.all_tags.add(tag)
-        
-        # Add existing
-        for t in tags_to_add:
-            if t not in current_tags:
-                current_tags.append(t)
+            new_tags = parse_tags(new_tags_text)
+            added |= new_tags
+            register_tags(new_tags)
         
         # Remove
-        for t in tags_to_remove:
-            if t in current_tags:
-                current_tags.remove(t)
+        new_tags = (current_tags | added) - set(tags_to_remove)
+
+        if new_tags == current_tags:
+            # Adds were already present and removals absent; skip the write
+            st.toast("Nothing to update.")
+            return
                 
-        st.session_state.db[index]['Tags'] = current_tags
-        save_data(st.session_state.username)
+        st.session_state.db[keyword] = new_tags
+        reindex_entry(keyword, current_tags, new_tags)
+        append_op({"op": "set", "keyword": keyword, "tags": sorted(new_tags)})
+        mark_dirty()
         st.toast("Entry updated!")
 
-def delete_entry(index):
-    if 0 <= index < len(st.session_state.db):
-        removed = st.session_state.db.pop(index)
-        save_data(st.session_state.username)
-        st.toast(f"Deleted '{removed['Keyword']}'")
+def delete_entry(keyword):
+    removed = st.session_state.db.pop(keyword, None)
+    if removed is not None:
+        reindex_entry(keyword, removed, set())
+        append_op({"op": "remove", "keyword": keyword})
+        mark_dirty()
+        st.toast(f"Deleted '{keyword}'")
         st.session_state.random_result = None
 
 # --- Import/Export Functions ---
-def convert_db_to_csv():
-    """Converts the session database list to a CSV string."""
-    if not st.session_state.db:
+@st.cache_data(show_spinner=False, max_entries=64)
+def convert_db_to_csv(db_key, _db):
+    """Converts the session database to CSV bytes, cached per db revision (see `db_key`)."""
+    if not _db:
         return ""
-    
-    # Create DataFrame
-    df = pd.DataFrame(st.session_state.db)
-    
-    # Join tags list into string "tag1, tag2"
-    if 'Tags' in df.columns:
-        df['Tags'] = df['Tags'].apply(lambda x: ', '.join(x) if isinstance(x, list) else "")
-    
-    return df.to_csv(index=False).encode('utf-8')
+    # Same frame as the table, tags joined into string "tag1, tag2"
+    return build_display_df(db_key, _db).to_csv(index=False).encode('utf-8')
 
 def process_csv_upload(uploaded_file):
-    """Reads CSV and merges into database."""
+    """Reads CSV and merges into database, one row at a time."""
+    text = TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline='')
+    # Initialize counters
+    added_count = 0
+    updated_count = 0
+    changed = False
     try:
-        df = pd.read_csv(uploaded_file)
+        reader = csv.DictReader(text)
         
         # Validation
-        if 'Keyword' not in df.columns:
+        if not reader.fieldnames or 'Keyword' not in reader.fieldnames:
             st.error("CSV must contain a 'Keyword' column.")
             return
 
-        # Initialize counters
-        added_count = 0
-        updated_count = 0
-        
-        # Helper to find existing entry index by keyword
-        existing_map = {entry['Keyword']: i for i, entry in enumerate(st.session_state.db)}
+        db = st.session_state.db
 
-        for _, row in df.iterrows():
-            kw = str(row['Keyword']).strip()
+        for row in reader:
+            kw = (row.get('Keyword') or '').strip()
             if not kw: 
                 continue
 
             # Parse tags
-            tags_str = str(row['Tags']) if 'Tags' in df.columns and pd.notna(row['Tags']) else ""
-            new_tags = [t.strip() for t in tags_str.split(',') if t.strip()]
+            new_tags = parse_tags(row.get('Tags') or '')
             
             # Update global tag set
-            for t in new_tags:
-                st.session_state.all_tags.add(t)
-
-            if kw in existing_map:
-                # Update existing entry
-                idx = existing_map[kw]
-                current_tags = st.session_state.db[idx]['Tags']
-                # Merge unique tags
-                for t in new_tags:
-                    if t not in current_tags:
-                        current_tags.append(t)
-                st.session_state.db[idx]['Tags'] = current_tags
+            register_tags(new_tags)
+
+            current_tags = db.get(kw)
+            if current_tags is not None:
+                # Update existing entry, merging unique tags
+                added = new_tags - current_tags
+                if added:
+                    current_tags |= added
+                    reindex_entry(kw, set(), added)
+                    append_op({"op": "set", "keyword": kw, "tags": sorted(current_tags)})
+                    changed = True
                 updated_count += 1
             else:
-                # Add new entry
-                st.session_state.db.append({"Keyword": kw, "Tags": new_tags})
-                # Update map prevents duplicates within the same CSV upload
-                existing_map[kw] = len(st.session_state.db) - 1
+                # Add new entry; later rows for the same keyword merge into it
+                db[kw] = new_tags
+                reindex_entry(kw, set(), new_tags)
+                append_op({"op": "set", "keyword": kw, "tags": sorted(new_tags)})
                 added_count += 1
+                changed = True
 
-        save_data(st.session_state.username)
         st.success(f"Import complete! Added {added_count} new entries, updated {updated_count} existing entries.")
         
     except Exception as e:
-        st.error(f"Error processing file: {e}")
+        # Rows are merged as they stream in, so the ones before the bad row are kept
+        st.error(f"Error processing file: {e} (rows before it were imported: {added_count} added, {updated_count} updated)")
+    finally:
+        if changed:
+            mark_dirty()
+        # Don't let the wrapper close the uploaded file when it is garbage collected
+        text.detach()
+
+# --- Display Functions ---
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_display_df(db_key, _db):
+    """Builds the table shown under 'Current Database', cached per db revision (see `db_key`)."""
+    import pandas as pd  # deferred: login-only sessions never need it
+
+    # Convert tag sets to strings for display
+    return pd.DataFrame({'Keyword': list(_db), 'Tags': [', '.join(sorted(tags)) for tags in _db.values()]})
+
+def render_tags_html(tags):
+    """Renders an entry's tags as coloured badges for the Random Picker."""
+    return ''.join(
+        f'<span style="background-color:{_TAG_BG[i & 7]}; color:{_TAG_FG[i & 7]}; padding:5px 10px; border-radius:15px; margin:0 5px; display:inline-block;">#{tag}</span>'
+        for i, tag in enumerate(sorted(tags))
+    )
+
+def get_random_result_html():
+    """Returns the badges for random_result, re-rendering only if the db changed since the last render."""
+    if st.session_state.random_result_html_rev != st.session_state.db_rev:
+        st.session_state.random_result_html = render_tags_html(st.session_state.db[st.session_state.random_result])
+        st.session_state.random_result_html_rev = st.session_state.db_rev
+    return st.session_state.random_result_html
 
 # --- Main App Interface ---
 def main_app():
@@ -253,7 +669,7 @@ def main_app():
             with col_ex:
                 st.subheader("Export Data")
                 st.caption("Download your keywords and tags as a CSV file.")
-                csv_data = convert_db_to_csv()
+                csv_data = convert_db_to_csv(db_key(), st.session_state.db)
                 if csv_data:
                     st.download_button(
                         label="📥 Download CSV",
@@ -282,8 +698,7 @@ def main_app():
                 with c1:
                     new_kw = st.text_input("Keyword", placeholder="e.g. Machine Learning")
                 with c2:
-                    tag_opts = sorted(list(st.session_state.all_tags))
-                    sel_tags = st.multiselect("Existing Tags", options=tag_opts)
+                    sel_tags = st.multiselect("Existing Tags", options=st.session_state.sorted_tags)
                     new_tags_in = st.text_input("New Tags (Comma-separated)", placeholder="urgent, study")
                 
                 if st.form_submit_button("Save"):
@@ -295,44 +710,40 @@ def main_app():
         st.subheader("Current Database")
         if st.session_state.db:
             # Show Table
-            df = pd.DataFrame(st.session_state.db)
-            df_display = df.copy()
-            # Convert list of tags to string for display
-            df_display['Tags'] = df_display['Tags'].apply(lambda x: ', '.join(x) if isinstance(x, list) else "")
-            st.dataframe(df_display, use_container_width=True)
+            st.dataframe(build_display_df(db_key(), st.session_state.db), use_container_width=True)
             
             st.write("### Edit Entry")
-            edit_opts = range(len(st.session_state.db))
-            selected_idx = st.selectbox(
+            selected_kw = st.selectbox(
                 "Select an entry to modify:", 
-                options=edit_opts, 
-                format_func=lambda x: f"{x+1}. {st.session_state.db[x]['Keyword']}"
+                options=list(st.session_state.db)
             )
 
-            if selected_idx is not None:
-                entry_data = st.session_state.db[selected_idx]
+            if selected_kw is not None:
+                entry_tags = st.session_state.db[selected_kw]
+                sorted_entry_tags = sorted(entry_tags)
                 with st.container(border=True):
-                    st.markdown(f"**Selected:** `{entry_data['Keyword']}`")
-                    st.caption(f"Current Tags: {', '.join(entry_data['Tags'])}")
+                    st.markdown(f"**Selected:** `{selected_kw}`")
+                    st.caption(f"Current Tags: {', '.join(sorted_entry_tags)}")
                     
                     ec1, ec2 = st.columns(2)
                     with ec1:
                         st.caption("Add Tags")
-                        avail = [t for t in st.session_state.all_tags if t not in entry_data['Tags']]
-                        add_exist = st.multiselect("Pick tags", sorted(avail), key="edit_add")
+                        # sorted_tags is already ordered, so filtering it keeps the order without a sort
+                        avail = [t for t in st.session_state.sorted_tags if t not in entry_tags]
+                        add_exist = st.multiselect("Pick tags", avail, key="edit_add")
                         add_new = st.text_input("Create tags (comma-separated)", key="edit_new")
                     with ec2:
                         st.caption("Remove Tags")
-                        rem_tags = st.multiselect("Select tags to remove", entry_data['Tags'], key="edit_rem")
+                        rem_tags = st.multiselect("Select tags to remove", sorted_entry_tags, key="edit_rem")
                     
                     b1, b2 = st.columns([1, 4])
                     with b1:
                         if st.button("Update", type="primary"):
-                            update_entry(selected_idx, add_exist, add_new, rem_tags)
+                            update_entry(selected_kw, add_exist, add_new, rem_tags)
                             st.rerun()
                     with b2:
                         if st.button("🗑️ Delete"):
-                            delete_entry(selected_idx)
+                            delete_entry(selected_kw)
                             st.rerun()
         else:
             #st.info("No data found for this account.")
@@ -341,29 +752,37 @@ def main_app():
     # === TAB 2: RANDOM RETRIEVE ===
     with tab_random:
         st.header("Random Picker")
+        tag_index = st.session_state.tag_index
+        pick_tag = st.selectbox(
+            "Only keywords tagged",
+            options=[None] + [t for t in st.session_state.sorted_tags if t in tag_index],
+            format_func=lambda t: "Any tag" if t is None else t,
+        )
         if st.button("🎲 Pick Random Keyword", type="primary", use_container_width=True):
             if not st.session_state.db:
                 st.warning("Database is empty.")
             else:
-                st.session_state.random_result = random.choice(st.session_state.db)
-
-        if st.session_state.random_result:
-            res = st.session_state.random_result
+                db = st.session_state.db
+                # tag_index gives the matching keywords directly, no scan of the db
+                candidates = tuple(db if pick_tag is None else tag_index[pick_tag])
+                picked = candidates[st.session_state.rng.randrange(len(candidates))]
+                st.session_state.random_result = picked
+                st.session_state.random_result_html = render_tags_html(db[picked])
+                st.session_state.random_result_html_rev = st.session_state.db_rev
+
+        if st.session_state.random_result in st.session_state.db:
             st.markdown("---")
-            st.subheader(res['Keyword'])
-            if res['Tags']:
-                html_tags = ""
-                colors = ["#e0f2f1", "#e3f2fd", "#f3e5f5", "#fbe9e7", "#fff3e0"]
-                text_colors = ["#00695c", "#1565c0", "#6a1b9a", "#d84315", "#ef6c00"]
-                for i, tag in enumerate(res['Tags']):
-                    bg = colors[i % len(colors)]
-                    tx = text_colors[i % len(colors)]
-                    html_tags += f'<span style="background-color:{bg}; color:{tx}; padding:5px 10px; border-radius:15px; margin:0 5px; display:inline-block;">#{tag}</span>'
-                st.markdown(html_tags, unsafe_allow_html=True)
+            st.subheader(st.session_state.random_result)
+            if st.session_state.db[st.session_state.random_result]:
+                st.markdown(get_random_result_html(), unsafe_allow_html=True)
             else:
                 st.caption("No tags assigned")
             st.markdown("---")
 
+    flush_if_needed()
+    if st.session_state.db_dirty:
+        autosave()
+
 # --- Login Interface ---
 def login_page():
     st.title("🔐 Login")